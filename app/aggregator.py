@@ -1,28 +1,41 @@
 # app/aggregator.py
 
-from datetime import datetime, timedelta
-from sqlalchemy.orm import Session as DBSession
-from sqlalchemy.dialects.mysql import insert
-from app.database import SessionLocal
-from app.sessions import sessions_manager
-from app.models import (
-    ActiveSession,
-    StatsGlobal,
-    StatsByServer,
-    StatsByChannel,
-    StatsByCountry,
-    StatsByProtocol,
-    StatsByUserAgent,
-)
+import tempfile
+import time
+import uuid
+from datetime import date, datetime
+from sqlalchemy import bindparam, select, text, Connection, TextClause
+from app.config import settings
+from app.database import engine
+from app.sessions import Session, sessions_manager
+from app.models import ActiveSession, StatsGlobal, StatsByDimension
 import logging
 
 logger = logging.getLogger(__name__)
 
+# (dim_kind stored in stats_by_dimension, key in sessions_manager minute stats)
+DIMENSION_KINDS = (
+    ("server", "by_server"),
+    ("channel", "by_channel"),
+    ("country", "by_country"),
+    ("protocol", "by_protocol"),
+    ("user_agent_class", "by_user_agent"),
+)
+
+# Dedicated compiled statement cache for the aggregator's connections
+_COMPILED_CACHE: dict = {}
+
 
-def get_minute_timestamp() -> datetime:
-    """Get current time truncated to the minute"""
-    now = datetime.utcnow()
-    return now.replace(second=0, microsecond=0)
+def _connect() -> Connection:
+    """Core connection (no ORM Session) using the aggregator's statement cache"""
+    return engine.connect().execution_options(compiled_cache=_COMPILED_CACHE)
+
+
+def get_previous_minute() -> datetime:
+    """Get the start of the previous minute (UTC)"""
+    # Integer epoch arithmetic - one datetime is built and shared by every row
+    minute_epoch = (int(time.time()) - 60) // 60 * 60
+    return datetime.utcfromtimestamp(minute_epoch)
 
 
 def run_aggregation() -> None:
@@ -30,97 +43,161 @@ def run_aggregation() -> None:
     Called every minute by scheduler.
     Collects stats and writes to database.
     """
-    minute = get_minute_timestamp() - timedelta(minutes=1)  # Stats for previous minute
+    minute = get_previous_minute()  # Stats for previous minute
 
     try:
         stats = sessions_manager.get_and_reset_minute_stats()
 
-        db = SessionLocal()
-        try:
-            # Write global stats
-            write_global_stats(db, minute, stats["global"])
-
-            # Write dimension stats
-            write_dimension_stats(db, minute, StatsByServer, "server", stats["by_server"])
-            write_dimension_stats(db, minute, StatsByChannel, "channel", stats["by_channel"])
-            write_dimension_stats(db, minute, StatsByCountry, "country", stats["by_country"])
-            write_dimension_stats(db, minute, StatsByProtocol, "protocol", stats["by_protocol"])
-            write_dimension_stats(db, minute, StatsByUserAgent, "user_agent_class", stats["by_user_agent"])
-
-            db.commit()
-            logger.info(f"Aggregation complete for {minute}: {stats['global']['sessions_started']} started, {stats['global']['sessions_closed']} closed, {stats['global']['current_concurrent']} active")
-
-        except Exception as e:
-            db.rollback()
-            logger.error(f"Aggregation failed: {e}")
-            raise
-        finally:
-            db.close()
+        # Stage all rows up front so the transaction only runs the upserts
+        writes = [(_UPSERT_STMTS[StatsGlobal], [global_stats_row(minute, stats["global"])])]
+        rows = []
+        for dim_kind, stats_key in DIMENSION_KINDS:
+            rows.extend(dimension_stats_rows(minute, dim_kind, stats[stats_key]))
+        if rows:
+            # Every dimension in one executemany
+            writes.append((_UPSERT_STMTS[StatsByDimension], rows))
+
+        # One transaction for all tables; commits on success, rolls back on error
+        with _connect() as conn, conn.begin():
+            for stmt, rows in writes:
+                conn.execute(stmt, rows)
+
+        logger.info(f"Aggregation complete for {minute}: {stats['global']['sessions_started']} started, {stats['global']['sessions_closed']} closed, {stats['global']['current_concurrent']} active")
 
     except Exception as e:
         logger.error(f"Aggregation error: {e}")
 
 
-def write_global_stats(db: DBSession, minute: datetime, stats: dict) -> None:
-    """Write global stats row"""
-    bandwidth_bps = stats["total_bytes"] // 60 if stats["total_bytes"] else 0
+def _build_upsert(table) -> TextClause:
+    """
+    Build a reusable INSERT ... ON DUPLICATE KEY UPDATE for a table.
 
-    stmt = insert(StatsGlobal).values(
-        minute=minute,
-        sessions_started=stats["sessions_started"],
-        sessions_closed=stats["sessions_closed"],
-        total_bytes=stats["total_bytes"],
-        bandwidth_bps=bandwidth_bps,
-        watch_time_seconds=stats["watch_time_seconds"],
-        unique_users=stats["unique_users"],
-        peak_concurrent=stats["peak_concurrent"],
+    Rendered as plain text with VALUES(col) so the statement has the
+    "INSERT ... VALUES (...) ON DUPLICATE KEY UPDATE" shape the MySQL
+    drivers rewrite into a single multi-row query on executemany.
+    """
+    columns = [column.name for column in table.columns]
+    update_columns = [column.name for column in table.columns if not column.primary_key]
+
+    return text(
+        f"INSERT INTO {table.name} ({', '.join(columns)}) "
+        f"VALUES ({', '.join(f':{c}' for c in columns)}) "
+        f"ON DUPLICATE KEY UPDATE {', '.join(f'{c} = VALUES({c})' for c in update_columns)}"
+    ).bindparams(
+        # Typed binds so column types (e.g. UUIDBinary) convert parameters
+        *[bindparam(column.name, type_=column.type) for column in table.columns]
     )
 
-    # Update if already exists (idempotent)
-    stmt = stmt.on_duplicate_key_update(
-        sessions_started=stmt.inserted.sessions_started,
-        sessions_closed=stmt.inserted.sessions_closed,
-        total_bytes=stmt.inserted.total_bytes,
-        bandwidth_bps=stmt.inserted.bandwidth_bps,
-        watch_time_seconds=stmt.inserted.watch_time_seconds,
-        unique_users=stmt.inserted.unique_users,
-        peak_concurrent=stmt.inserted.peak_concurrent,
-    )
 
-    db.execute(stmt)
+# Upsert statements built once at import - only parameters are bound per call
+_UPSERT_STMTS: dict = {
+    model: _build_upsert(model.__table__)
+    for model in (ActiveSession, StatsGlobal, StatsByDimension)
+}
+
 
+# Every row for a table starts from the same key set, in column order, so
+# each minute's executemany binds an identical parameter layout
+_ROW_TEMPLATES: dict = {
+    model: dict.fromkeys((column.name for column in model.__table__.columns), 0)
+    for model in (StatsGlobal, StatsByDimension)
+}
 
-def write_dimension_stats(db: DBSession, minute: datetime, model, dimension_column: str, stats_by_dimension: dict) -> None:
-    """Write stats for a dimension (server, channel, country, etc.)"""
 
+def _stats_row(template: dict, minute: datetime, stats: dict) -> dict:
+    """Fill a stats row template with one set of minute stats"""
+    row = template.copy()
+    row["minute"] = minute
+    # Counters missing from the stats dict stay 0, the key set never changes
+    total_bytes = stats.get("total_bytes", 0)
+    row["sessions_started"] = stats.get("sessions_started", 0)
+    row["sessions_closed"] = stats.get("sessions_closed", 0)
+    row["total_bytes"] = total_bytes
+    row["bandwidth_bps"] = total_bytes // 60
+    row["watch_time_seconds"] = stats.get("watch_time_seconds", 0)
+    row["unique_users"] = stats.get("unique_users", 0)
+    row["peak_concurrent"] = stats.get("peak_concurrent", 0)
+    return row
+
+
+def global_stats_row(minute: datetime, stats: dict) -> dict:
+    """Build the global stats row"""
+    return _stats_row(_ROW_TEMPLATES[StatsGlobal], minute, stats)
+
+
+def dimension_stats_rows(minute: datetime, dim_kind: str, stats_by_dimension: dict) -> list[dict]:
+    """Build the stats_by_dimension rows for one dimension (server, channel, country, etc.)"""
+    template = _ROW_TEMPLATES[StatsByDimension]
+    rows = []
     for dimension_value, stats in stats_by_dimension.items():
-        bandwidth_bps = stats["total_bytes"] // 60 if stats["total_bytes"] else 0
-
-        values = {
-            "minute": minute,
-            dimension_column: dimension_value,
-            "sessions_started": stats["sessions_started"],
-            "sessions_closed": stats["sessions_closed"],
-            "total_bytes": stats["total_bytes"],
-            "bandwidth_bps": bandwidth_bps,
-            "watch_time_seconds": stats["watch_time_seconds"],
-            "unique_users": stats["unique_users"],
-            "peak_concurrent": stats["peak_concurrent"],
-        }
+        row = _stats_row(template, minute, stats)
+        row["dim_kind"] = dim_kind
+        row["dim_value"] = dimension_value
+        rows.append(row)
+    return rows
+
+
+def _month_start(year: int, month: int) -> date:
+    """First day of a month, normalizing month overflow (13 -> January next year)"""
+    return date(year + (month - 1) // 12, (month - 1) % 12 + 1, 1)
 
-        stmt = insert(model).values(**values)
 
-        stmt = stmt.on_duplicate_key_update(
-            sessions_started=stmt.inserted.sessions_started,
-            sessions_closed=stmt.inserted.sessions_closed,
-            total_bytes=stmt.inserted.total_bytes,
-            bandwidth_bps=stmt.inserted.bandwidth_bps,
-            watch_time_seconds=stmt.inserted.watch_time_seconds,
-            unique_users=stmt.inserted.unique_users,
-            peak_concurrent=stmt.inserted.peak_concurrent,
-        )
+def ensure_stats_partitions() -> None:
+    """
+    Split monthly partitions off stats_by_dimension's p_future partition,
+    from the current month to settings.stats_partition_months_ahead ahead.
+    Called at startup and daily by scheduler. p_future stays empty as long as
+    this runs, so the reorganize never has to move rows.
+    """
+    table = StatsByDimension.__tablename__
+    today = datetime.utcnow().date()
+
+    try:
+        with _connect() as conn, conn.begin():
+            existing = set(conn.execute(
+                text(
+                    "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+                    "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table"
+                ),
+                {"table": table},
+            ).scalars())
+
+            # Table not partitioned (e.g. created before partitioning) - nothing to split
+            if "p_future" not in existing:
+                logger.warning(f"{table} has no p_future partition - skipping partition maintenance")
+                return
+
+            partitions = []
+            for offset in range(settings.stats_partition_months_ahead + 1):
+                start = _month_start(today.year, today.month + offset)
+                name = f"p{start:%Y%m}"
+                if name not in existing:
+                    end = _month_start(start.year, start.month + 1)
+                    partitions.append(f"PARTITION {name} VALUES LESS THAN (TO_DAYS('{end:%Y-%m-%d}'))")
+
+            if partitions:
+                conn.execute(text(
+                    f"ALTER TABLE {table} REORGANIZE PARTITION p_future INTO "
+                    f"({', '.join(partitions)}, PARTITION p_future VALUES LESS THAN MAXVALUE)"
+                ))
+                logger.info(f"Added {len(partitions)} monthly partitions to {table}")
+
+    except Exception as e:
+        logger.error(f"Partition maintenance failed: {e}")
+
 
-        db.execute(stmt)
+# Last generation handed out by _next_sync_generation
+_last_sync_generation = 0
+
+
+def _next_sync_generation() -> int:
+    """
+    Id for one sync run, strictly increasing. Based on the wall clock in
+    nanoseconds so it also keeps increasing across restarts.
+    """
+    global _last_sync_generation
+    _last_sync_generation = max(time.time_ns(), _last_sync_generation + 1)
+    return _last_sync_generation
 
 
 def sync_active_sessions() -> None:
@@ -130,64 +207,131 @@ def sync_active_sessions() -> None:
     """
     sessions = sessions_manager.get_all_sessions()
 
-    db = SessionLocal()
+    now = datetime.utcnow().replace(microsecond=0)
+    generation = _next_sync_generation()
+
     try:
-        # Clear old sessions and write current
-        db.query(ActiveSession).delete()
+        with _connect() as conn, conn.begin():
+            # Write current sessions, stamping each with this sync's generation
+            if settings.db_local_infile and len(sessions) >= settings.session_bulk_load_threshold:
+                _bulk_load_sessions(conn, sessions, now, generation)
+            elif sessions:
+                conn.execute(_UPSERT_STMTS[ActiveSession], _session_rows(sessions, now, generation))
+
+            # Anything not written by this sync has closed since the last one.
+            # Compared by generation, not updated_at, so two syncs within the
+            # same second still remove rows closed in between
+            conn.execute(ActiveSession.__table__.delete().where(ActiveSession.sync_generation != generation))
 
-        for session in sessions:
-            db.add(ActiveSession(
-                id=session.id,
-                server=session.server,
-                media=session.media,
-                user_id=session.user_id,
-                country=session.country,
-                proto=session.proto,
-                user_agent_class=session.user_agent_class,
-                bytes=session.bytes,
-                opened_at=session.opened_at,
-                updated_at=datetime.utcnow(),
-            ))
-
-        db.commit()
         logger.debug(f"Synced {len(sessions)} active sessions to database")
 
     except Exception as e:
-        db.rollback()
         logger.error(f"Session sync failed: {e}")
-    finally:
-        db.close()
+
+
+def _session_rows(sessions: list[Session], now: datetime, generation: int) -> list[dict]:
+    """Build active_sessions rows for the batched upsert"""
+    return [
+        {
+            "id": session.id,
+            "server": session.server,
+            "media": session.media,
+            "user_id": session.user_id,
+            "country": session.country,
+            "proto": session.proto,
+            "user_agent_class": session.user_agent_class,
+            "bytes": session.bytes,
+            "opened_at": session.opened_at,
+            "updated_at": now,
+            "sync_generation": generation,
+        }
+        for session in sessions
+    ]
+
+
+# Field escaping for LOAD DATA's default ESCAPED BY '\\'
+_TSV_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n"})
+
+# Bulk loads go through a per-connection staging table and are merged with an
+# upsert - LOAD DATA ... REPLACE would delete and re-insert every existing row
+_SESSIONS_STAGING_TABLE = "active_sessions_load"
+_SESSION_COLUMNS = ", ".join(column.name for column in ActiveSession.__table__.columns)
+
+_CREATE_SESSIONS_STAGING_SQL = f"CREATE TEMPORARY TABLE {_SESSIONS_STAGING_TABLE} LIKE active_sessions"
+_DROP_SESSIONS_STAGING_SQL = f"DROP TEMPORARY TABLE IF EXISTS {_SESSIONS_STAGING_TABLE}"
+
+_LOAD_SESSIONS_SQL = (
+    f"LOAD DATA LOCAL INFILE %s INTO TABLE {_SESSIONS_STAGING_TABLE} "
+    "FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' "
+    "(@id, server, media, user_id, country, proto, user_agent_class, bytes, opened_at, updated_at, sync_generation) "
+    "SET id = UNHEX(@id)"
+)
+
+_MERGE_SESSIONS_SQL = (
+    f"INSERT INTO active_sessions ({_SESSION_COLUMNS}) "
+    f"SELECT {_SESSION_COLUMNS} FROM {_SESSIONS_STAGING_TABLE} "
+    "ON DUPLICATE KEY UPDATE " + ", ".join(
+        f"{column.name} = {_SESSIONS_STAGING_TABLE}.{column.name}"
+        for column in ActiveSession.__table__.columns if not column.primary_key
+    )
+)
+
+
+def _bulk_load_sessions(conn: Connection, sessions: list[Session], now: datetime, generation: int) -> None:
+    """
+    Write sessions with LOAD DATA LOCAL INFILE from a temporary TSV file into
+    a staging table, then merge it into active_sessions with one
+    INSERT ... SELECT ... ON DUPLICATE KEY UPDATE. Much cheaper than a
+    multi-row INSERT for very large session counts.
+    """
+    updated_at = now.strftime("%Y-%m-%d %H:%M:%S")
+    sync_generation = str(generation)
+
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", suffix=".tsv") as tsv:
+        for session in sessions:
+            tsv.write("\t".join((
+                uuid.UUID(session.id).hex,
+                session.server.translate(_TSV_ESCAPES),
+                session.media.translate(_TSV_ESCAPES),
+                session.user_id.translate(_TSV_ESCAPES),
+                session.country.translate(_TSV_ESCAPES),
+                session.proto.translate(_TSV_ESCAPES),
+                session.user_agent_class,
+                str(session.bytes),
+                str(session.opened_at),
+                updated_at,
+                sync_generation,
+            )) + "\n")
+        tsv.flush()
+
+        # Temporary tables live as long as the pooled connection - start clean
+        conn.exec_driver_sql(_DROP_SESSIONS_STAGING_SQL)
+        conn.exec_driver_sql(_CREATE_SESSIONS_STAGING_SQL)
+        try:
+            conn.exec_driver_sql(_LOAD_SESSIONS_SQL, (tsv.name,))
+            conn.exec_driver_sql(_MERGE_SESSIONS_SQL)
+        finally:
+            conn.exec_driver_sql(_DROP_SESSIONS_STAGING_SQL)
 
 
 def restore_active_sessions() -> None:
     """
     Load active sessions from database on startup.
     """
-    db = SessionLocal()
     try:
-        rows = db.query(ActiveSession).all()
-
-        from app.sessions import Session
-        sessions = [
-            Session(
-                id=row.id,
-                server=row.server,
-                media=row.media,
-                user_id=row.user_id,
-                country=row.country,
-                proto=row.proto,
-                user_agent_class=row.user_agent_class,
-                bytes=row.bytes,
-                opened_at=row.opened_at,
-                updated_at=row.updated_at,
-            )
-            for row in rows
-        ]
+        with _connect() as conn:
+            # Plain row mappings - no ORM instances built only to be discarded.
+            # updated_at and sync_generation are sync bookkeeping only, not part of the in-memory session
+            columns = [
+                column for column in ActiveSession.__table__.columns
+                if column.name not in ("updated_at", "sync_generation")
+            ]
+            rows = conn.execute(select(*columns)).mappings().all()
+
+        sessions = [Session(**row) for row in rows]
 
         sessions_manager.restore_sessions(sessions)
         logger.info(f"Restored {len(sessions)} active sessions from database")
 
     except Exception as e:
-        logger.error(f"Session restore failed: {e}")
-    finally:
-        db.close()
\ No newline at end of file
+        logger.error(f"Session restore failed: {e}")
\ No newline at end of file
@@ -6,6 +6,7 @@ from urllib.parse import quote_plus
 
 class Settings(BaseSettings):
     # MySQL connection
+    db_driver: str = "mysqldb"  # mysqlclient (C extension); "pymysql" as pure-Python fallback
     db_host: str = "localhost"
     db_port: int = 3306
     db_user: str = "stream_api"
@@ -16,18 +17,32 @@ class Settings(BaseSettings):
     db_pool_size: int = 10
     db_pool_overflow: int = 20
 
+    # Webhook batches queued for ingest before new requests wait for room
+    webhook_queue_size: int = 1000
+
     # Aggregation
     aggregation_interval_seconds: int = 60
 
+    # Distinct servers / channels stored per minute - the rest are summed as "__other__"
+    stats_max_dimension_values: int = 1000
+
+    # Monthly stats_by_dimension partitions created ahead of the current month
+    stats_partition_months_ahead: int = 3
+
     # Active sessions persistence (backup to DB every N seconds)
     session_sync_interval_seconds: int = 30
 
+    # Bulk-load large session syncs via LOAD DATA LOCAL INFILE
+    # (MySQL server must also have local_infile=ON)
+    db_local_infile: bool = False
+    session_bulk_load_threshold: int = 5000
+
     @property
     def database_url(self) -> str:
         password = quote_plus(self.db_password)
         return (
-            f"mysql+pymysql://{self.db_user}:{password}"
-            f"@{self.db_host}:{self.db_port}/{self.db_name}"
+            f"mysql+{self.db_driver}://{self.db_user}:{password}"
+            f"@{self.db_host}:{self.db_port}/{self.db_name}?charset=utf8mb4"
         )
 
     class Config:
@@ -9,6 +9,7 @@ engine = create_engine(
     pool_size=settings.db_pool_size,
     max_overflow=settings.db_pool_overflow,
     pool_pre_ping=True,
+    connect_args={"local_infile": 1} if settings.db_local_infile else {},
 )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -1,12 +1,14 @@
 # app/main.py
 
+import asyncio
+import time
 from contextlib import asynccontextmanager
+from typing import Callable
 from fastapi import FastAPI
-from apscheduler.schedulers.background import BackgroundScheduler
 from app.config import settings
 from app.database import init_db
-from app.webhook import router as webhook_router
-from app.aggregator import run_aggregation, sync_active_sessions, restore_active_sessions
+from app.webhook import router as webhook_router, ingest_queue, ingest_worker
+from app.aggregator import run_aggregation, sync_active_sessions, restore_active_sessions, ensure_stats_partitions
 import logging
 
 # Configure logging
@@ -16,8 +18,36 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Scheduler instance
-scheduler = BackgroundScheduler()
+
+def next_minute() -> float:
+    """Unix time of the next :00"""
+    return (time.time() // 60 + 1) * 60
+
+
+async def run_scheduled(job: Callable[[], None], next_run: Callable[[], float], stop: asyncio.Event) -> None:
+    """
+    Run a blocking job in a worker thread each time next_run() comes due.
+    Returns once stop is set, after any in-progress run has finished.
+    """
+    while True:
+        run_at = next_run()
+
+        # Sleep until due - re-check the clock in case the loop wakes early
+        while (delay := run_at - time.time()) > 0:
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=delay)
+                return
+            except asyncio.TimeoutError:
+                pass
+
+        # Apply webhook batches already queued first, so they land in the
+        # minute / sync they arrived in rather than the next one
+        await ingest_queue.join()
+
+        try:
+            await asyncio.to_thread(job)
+        except Exception as e:
+            logger.error(f"Scheduled job {job.__name__} failed: {e}")
 
 
 @asynccontextmanager
@@ -29,30 +59,32 @@ async def lifespan(app: FastAPI):
 
     # Initialize database tables
     init_db()
+    ensure_stats_partitions()
     logger.info("Database initialized")
 
     # Restore active sessions from DB
     restore_active_sessions()
 
-    # Schedule aggregation job (every minute at :00)
-    scheduler.add_job(
-        run_aggregation,
-        trigger="cron",
-        second=0,
-        id="aggregation",
-        replace_existing=True,
-    )
-
-    # Schedule session sync job (every N seconds)
-    scheduler.add_job(
-        sync_active_sessions,
-        trigger="interval",
-        seconds=settings.session_sync_interval_seconds,
-        id="session_sync",
-        replace_existing=True,
-    )
-
-    scheduler.start()
+    # Applies queued webhook batches to the sessions manager
+    ingest_task = asyncio.create_task(ingest_worker())
+
+    stop = asyncio.Event()
+    jobs = [
+        # Aggregation job (every minute at :00)
+        asyncio.create_task(run_scheduled(run_aggregation, next_minute, stop)),
+        # Session sync job (every N seconds)
+        asyncio.create_task(run_scheduled(
+            sync_active_sessions,
+            lambda: time.time() + settings.session_sync_interval_seconds,
+            stop,
+        )),
+        # Partition maintenance job (daily)
+        asyncio.create_task(run_scheduled(
+            ensure_stats_partitions,
+            lambda: time.time() + 86400,
+            stop,
+        )),
+    ]
     logger.info("Scheduler started")
 
     logger.info(f"Stream Stats API ready - listening for webhooks")
@@ -62,7 +94,12 @@ async def lifespan(app: FastAPI):
     # Shutdown
     logger.info("Shutting down...")
 
-    scheduler.shutdown(wait=True)
+    # Apply any webhook batches still queued, so the final sync includes them
+    await ingest_queue.join()
+    ingest_task.cancel()
+
+    stop.set()
+    await asyncio.gather(*jobs)
     logger.info("Scheduler stopped")
 
     # Final session sync before exit
@@ -78,4 +115,4 @@ app = FastAPI(
 )
 
 # Register routes
-app.include_router(webhook_router)
\ No newline at end of file
+app.include_router(webhook_router)
@@ -1,16 +1,35 @@
 # app/models.py
 
+import uuid
 from sqlalchemy import (
     Column, String, Integer, BigInteger, DateTime, Index
 )
+from sqlalchemy.dialects.mysql import BINARY
+from sqlalchemy.types import TypeDecorator
 from app.database import Base
 
 
+class UUIDBinary(TypeDecorator):
+    """UUID string in Python, stored as 16 raw bytes"""
+    impl = BINARY(16)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return uuid.UUID(value).bytes
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return str(uuid.UUID(bytes=value))
+
+
 class ActiveSession(Base):
     """In-memory primary, DB for persistence/recovery"""
     __tablename__ = "active_sessions"
 
-    id = Column(String(36), primary_key=True)  # UUID from event
+    id = Column(UUIDBinary, primary_key=True)  # UUID from event
     server = Column(String(100), nullable=False)
     media = Column(String(100), nullable=False)
     user_id = Column(String(100), nullable=False)
@@ -20,6 +39,7 @@ class ActiveSession(Base):
     bytes = Column(BigInteger, default=0)
     opened_at = Column(BigInteger, nullable=False)  # Unix ms
     updated_at = Column(DateTime, nullable=False)
+    sync_generation = Column(BigInteger, nullable=False, default=0)  # Sync run that last wrote the row
 
 
 class StatsGlobal(Base):
@@ -36,25 +56,24 @@ class StatsGlobal(Base):
     peak_concurrent = Column(Integer, default=0)
 
 
-class StatsByServer(Base):
-    __tablename__ = "stats_by_server"
-
-    minute = Column(DateTime, primary_key=True)
-    server = Column(String(100), primary_key=True)
-    sessions_started = Column(Integer, default=0)
-    sessions_closed = Column(Integer, default=0)
-    total_bytes = Column(BigInteger, default=0)
-    bandwidth_bps = Column(BigInteger, default=0)
-    watch_time_seconds = Column(BigInteger, default=0)
-    unique_users = Column(Integer, default=0)
-    peak_concurrent = Column(Integer, default=0)
-
-
-class StatsByChannel(Base):
-    __tablename__ = "stats_by_channel"
+class StatsByDimension(Base):
+    """
+    Per-minute aggregates for every dimension, one row per (minute, kind, value).
+    Range-partitioned by month - see app.aggregator.ensure_stats_partitions.
+    """
+    __tablename__ = "stats_by_dimension"
+    __table_args__ = (
+        Index("ix_stats_by_dimension_minute_bw", "minute", "bandwidth_bps", "total_bytes"),
+        Index("ix_stats_by_dimension_kind_value_minute", "dim_kind", "dim_value", "minute"),  # Per-value time ranges
+        {
+            # Every month gets its own partition, split off p_future ahead of time
+            "mysql_partition_by": "RANGE (TO_DAYS(minute)) (PARTITION p_future VALUES LESS THAN MAXVALUE)",
+        },
+    )
 
     minute = Column(DateTime, primary_key=True)
-    channel = Column(String(100), primary_key=True)
+    dim_kind = Column(String(16), primary_key=True)  # server, channel, country, protocol, user_agent_class
+    dim_value = Column(String(100), primary_key=True)
     sessions_started = Column(Integer, default=0)
     sessions_closed = Column(Integer, default=0)
     total_bytes = Column(BigInteger, default=0)
@@ -62,45 +81,3 @@ class StatsByChannel(Base):
     watch_time_seconds = Column(BigInteger, default=0)
     unique_users = Column(Integer, default=0)
     peak_concurrent = Column(Integer, default=0)
-
-
-class StatsByCountry(Base):
-    __tablename__ = "stats_by_country"
-
-    minute = Column(DateTime, primary_key=True)
-    country = Column(String(10), primary_key=True)
-    sessions_started = Column(Integer, default=0)
-    sessions_closed = Column(Integer, default=0)
-    total_bytes = Column(BigInteger, default=0)
-    bandwidth_bps = Column(BigInteger, default=0)
-    watch_time_seconds = Column(BigInteger, default=0)
-    unique_users = Column(Integer, default=0)
-    peak_concurrent = Column(Integer, default=0)
-
-
-class StatsByProtocol(Base):
-    __tablename__ = "stats_by_protocol"
-
-    minute = Column(DateTime, primary_key=True)
-    protocol = Column(String(20), primary_key=True)
-    sessions_started = Column(Integer, default=0)
-    sessions_closed = Column(Integer, default=0)
-    total_bytes = Column(BigInteger, default=0)
-    bandwidth_bps = Column(BigInteger, default=0)
-    watch_time_seconds = Column(BigInteger, default=0)
-    unique_users = Column(Integer, default=0)
-    peak_concurrent = Column(Integer, default=0)
-
-
-class StatsByUserAgent(Base):
-    __tablename__ = "stats_by_user_agent"
-
-    minute = Column(DateTime, primary_key=True)
-    user_agent_class = Column(String(20), primary_key=True)
-    sessions_started = Column(Integer, default=0)
-    sessions_closed = Column(Integer, default=0)
-    total_bytes = Column(BigInteger, default=0)
-    bandwidth_bps = Column(BigInteger, default=0)
-    watch_time_seconds = Column(BigInteger, default=0)
-    unique_users = Column(Integer, default=0)
-    peak_concurrent = Column(Integer, default=0)
\ No newline at end of file
@@ -1,17 +1,25 @@
 # app/schemas.py
 
-from pydantic import BaseModel, Field
-from typing import Optional, Literal
+import uuid
+import msgspec
+from pydantic import BaseModel
+from typing import Annotated, Optional, Literal
 from datetime import datetime
 
+# Session ids are persisted as BINARY(16), so they must be UUIDs
+SessionId = Annotated[
+    str,
+    msgspec.Meta(pattern=r"^[0-9a-fA-F]{8}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{12}$"),
+]
 
-class StreamEvent(BaseModel):
-    """Incoming event from streaming server"""
+
+class StreamEvent(msgspec.Struct, kw_only=True):
+    """Incoming event from streaming server (unknown fields are ignored)"""
 
     # Event identification
     time: datetime
     event: Literal["play_started", "play_closed"]
-    id: str  # Session UUID
+    id: SessionId  # Session UUID
 
     # Source
     server: str
@@ -43,11 +51,14 @@ class StreamEvent(BaseModel):
     module: Optional[str] = None
     line: Optional[int] = None
 
-    class Config:
-        extra = "ignore"  # Ignore unexpected fields
+    def __post_init__(self):
+        # The pattern accepts any case and optional hyphens, but sessions are
+        # keyed by id - normalize to the canonical form UUIDBinary reads back
+        if len(self.id) != 36 or self.id != self.id.lower():
+            self.id = str(uuid.UUID(self.id))
 
 
 class WebhookResponse(BaseModel):
     status: str
     processed: int
-    errors: int = 0
\ No newline at end of file
+    errors: int = 0
@@ -1,13 +1,28 @@
 # app/sessions.py
 
-from dataclasses import dataclass, field
-from datetime import datetime
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from operator import attrgetter
+from sys import intern
 from threading import Lock
-from typing import Dict, Set
+from typing import Dict, Optional
+from datasketches import hll_sketch, tgt_hll_type
 from app.classifier import classify_user_agent_cached
+from app.config import settings
+from app.schemas import StreamEvent
 
 
-@dataclass
+# Unique users are counted with HyperLogLog sketches: fixed size (at most
+# ~4 KiB at lg_k=12) however many users a minute sees, ~1.6% typical error.
+# Small counts are tracked exactly until the sketch switches to HLL mode.
+UNIQUE_USERS_LG_K = 12
+
+
+def _new_unique_users() -> hll_sketch:
+    return hll_sketch(UNIQUE_USERS_LG_K, tgt_hll_type.HLL_8)
+
+
+@dataclass(slots=True)
 class Session:
     """Single active session"""
     id: str
@@ -19,7 +34,53 @@ class Session:
     user_agent_class: str
     bytes: int
     opened_at: int  # Unix ms
-    updated_at: datetime = field(default_factory=datetime.utcnow)
+
+
+class _MinuteStats:
+    """
+    Counters for one aggregation minute.
+    Swapped out whole on reset, so the finished minute is read without the lock.
+    Two are kept and reused alternately (see get_and_reset_minute_stats).
+    """
+
+    def __init__(self, peak_concurrent: int = 0):
+        self.started: int = 0
+        self.closed: int = 0
+        self.bytes: int = 0
+        self.watch_time_ms: int = 0
+        self.unique_users: hll_sketch = _new_unique_users()
+        self.peak_concurrent: int = peak_concurrent
+
+        # Dimension-specific tracking - entries created on first use
+        # Server and channel values are open-ended, so they're capped per minute
+        self.by_server: "BoundedDimensionMap" = BoundedDimensionMap(settings.stats_max_dimension_values)
+        self.by_channel: "BoundedDimensionMap" = BoundedDimensionMap(settings.stats_max_dimension_values)
+        self.by_country: Dict[str, "DimensionStats"] = defaultdict(DimensionStats)
+        self.by_protocol: Dict[str, "DimensionStats"] = defaultdict(DimensionStats)
+        self.by_user_agent: Dict[str, "DimensionStats"] = defaultdict(DimensionStats)
+
+    def reset(self, peak_concurrent: int) -> None:
+        """Zero for reuse as a new minute"""
+        self.started = 0
+        self.closed = 0
+        self.bytes = 0
+        self.watch_time_ms = 0
+        self.unique_users.reset()
+        self.peak_concurrent = peak_concurrent
+
+        self.by_server.clear()
+        self.by_channel.clear()
+
+        # Country, protocol and user agent class have a small, stable set of
+        # values - entries seen this minute are zeroed in place instead of
+        # reallocated, entries with no activity are dropped so values that
+        # stop appearing don't accumulate forever
+        for dimension_dict in (self.by_country, self.by_protocol, self.by_user_agent):
+            inactive = [key for key, stats in dimension_dict.items() if not (stats.started or stats.closed)]
+            for key in inactive:
+                del dimension_dict[key]
+            for stats in dimension_dict.values():
+                stats.reset()
 
 
 class ActiveSessionsManager:
@@ -28,185 +89,222 @@ class ActiveSessionsManager:
     Thread-safe for concurrent webhook requests.
     """
 
-    def __init__(self):
+    def __init__(self) -> None:
         self._sessions: Dict[str, Session] = {}
-        self._lock = Lock()
-
-        # Per-minute tracking (reset each aggregation cycle)
-        self._minute_started: int = 0
-        self._minute_closed: int = 0
-        self._minute_bytes: int = 0
-        self._minute_watch_time_ms: int = 0
-        self._minute_unique_users: Set[str] = set()
-        self._minute_peak_concurrent: int = 0
-
-        # Dimension-specific tracking for current minute
-        self._minute_by_server: Dict[str, DimensionStats] = {}
-        self._minute_by_channel: Dict[str, DimensionStats] = {}
-        self._minute_by_country: Dict[str, DimensionStats] = {}
-        self._minute_by_protocol: Dict[str, DimensionStats] = {}
-        self._minute_by_user_agent: Dict[str, DimensionStats] = {}
-
-    def session_started(self, event_data: dict) -> None:
-        """Handle play_started event"""
-        user_agent_class = classify_user_agent_cached(event_data.get("user_agent", ""))
-
-        session = Session(
-            id=event_data["id"],
-            server=event_data["server"],
-            media=event_data["media"],
-            user_id=event_data.get("user_id") or event_data["id"],
-            country=event_data.get("country") or "XX",
-            proto=event_data.get("proto") or "unknown",
-            user_agent_class=user_agent_class,
-            bytes=event_data.get("bytes", 0),
-            opened_at=event_data["opened_at"],
+        self._counters_lock = Lock()  # Guards the minute counters only
+
+        # Per-minute tracking (swapped each aggregation cycle)
+        self._minute = _MinuteStats()
+        self._spare_minute = _MinuteStats()  # Finished minute, free to reuse
+
+    def ingest_batch(self, events: list[StreamEvent]) -> None:
+        """
+        Handle a batch of validated events.
+        The sessions dict is updated lock-free (single dict operations are
+        atomic under the GIL); the minute counters are then applied under a
+        single lock acquisition.
+        """
+        # Hot loop - methods and containers bound to locals once per batch
+        sessions = self._sessions
+        new_session = self._new_session
+        started = []
+        closed = []
+
+        # Running concurrency count - one len() per batch, int ops per event
+        concurrent = len(sessions)
+        peak_concurrent = 0
+
+        for event in events:
+            if event.event == "play_started":
+                session = new_session(event)
+                if sessions.setdefault(session.id, session) is session:
+                    concurrent += 1
+
+                    # Track peak concurrent
+                    if concurrent > peak_concurrent:
+                        peak_concurrent = concurrent
+                else:
+                    # Repeated play_started replaces the session, count unchanged
+                    sessions[session.id] = session
+                started.append(session)
+            else:
+                closed_session = sessions.pop(event.id, None)
+                if closed_session:
+                    concurrent -= 1
+                closed.append((event, closed_session))
+
+        apply_started = self._apply_started
+        apply_closed = self._apply_closed
+        with self._counters_lock:
+            minute = self._minute
+            for session in started:
+                apply_started(minute, session)
+            for event, closed_session in closed:
+                apply_closed(minute, event, closed_session)
+            if peak_concurrent > minute.peak_concurrent:
+                minute.peak_concurrent = peak_concurrent
+
+    def _new_session(self, event: StreamEvent) -> Session:
+        """Build the session for a play_started event"""
+        # Low-cardinality dimension values are interned so every session shares
+        # one string per value and dimension dict lookups hit the identity fast path
+        return Session(
+            id=event.id,
+            server=intern(event.server),
+            media=intern(event.media),
+            user_id=event.user_id or event.id,
+            country=intern(event.country or "XX"),
+            proto=intern(event.proto or "unknown"),
+            user_agent_class=classify_user_agent_cached(event.user_agent or ""),
+            bytes=event.bytes,
+            opened_at=event.opened_at,
         )
 
-        with self._lock:
-            self._sessions[session.id] = session
+    def _apply_started(self, minute: _MinuteStats, session: Session) -> None:
+        """Count a started session - caller holds the counters lock"""
+        user_id = session.user_id
+
+        # Update minute counters
+        minute.started += 1
+        minute.unique_users.update(user_id)
+
+        # Update dimension stats
+        minute.by_server[session.server].add_started(user_id)
+        minute.by_channel[session.media].add_started(user_id)
+        minute.by_country[session.country].add_started(user_id)
+        minute.by_protocol[session.proto].add_started(user_id)
+        minute.by_user_agent[session.user_agent_class].add_started(user_id)
+
+    def _apply_closed(self, minute: _MinuteStats, event: StreamEvent, session: Optional[Session]) -> None:
+        """Count a play_closed event (session already removed, if known) - caller holds the counters lock"""
+        if session:
+            # Calculate watch time and bytes for this session
+            closed_at = event.closed_at
+            watch_time_ms = closed_at - session.opened_at if closed_at else 0
+            final_bytes = event.bytes
+            bytes_delta = final_bytes - session.bytes
+            user_id = session.user_id
 
             # Update minute counters
-            self._minute_started += 1
-            self._minute_unique_users.add(session.user_id)
+            minute.closed += 1
+            minute.bytes += bytes_delta
+            minute.watch_time_ms += watch_time_ms
+            minute.unique_users.update(user_id)
 
-            # Track peak concurrent
-            current_concurrent = len(self._sessions)
-            if current_concurrent > self._minute_peak_concurrent:
-                self._minute_peak_concurrent = current_concurrent
+            # Update dimension stats
+            minute.by_server[session.server].add_closed(user_id, bytes_delta, watch_time_ms)
+            minute.by_channel[session.media].add_closed(user_id, bytes_delta, watch_time_ms)
+            minute.by_country[session.country].add_closed(user_id, bytes_delta, watch_time_ms)
+            minute.by_protocol[session.proto].add_closed(user_id, bytes_delta, watch_time_ms)
+            minute.by_user_agent[session.user_agent_class].add_closed(user_id, bytes_delta, watch_time_ms)
+        else:
+            # Session not found - still count the close event
+            user_agent_class = classify_user_agent_cached(event.user_agent or "")
+            user_id = event.user_id or event.id
+            country = event.country or "XX"
+            proto = event.proto or "unknown"
+            final_bytes = event.bytes
+
+            minute.closed += 1
+            minute.bytes += final_bytes
+            minute.unique_users.update(user_id)
 
             # Update dimension stats
-            self._get_dimension_stats(self._minute_by_server, session.server).add_started(session.user_id)
-            self._get_dimension_stats(self._minute_by_channel, session.media).add_started(session.user_id)
-            self._get_dimension_stats(self._minute_by_country, session.country).add_started(session.user_id)
-            self._get_dimension_stats(self._minute_by_protocol, session.proto).add_started(session.user_id)
-            self._get_dimension_stats(self._minute_by_user_agent, user_agent_class).add_started(session.user_id)
-
-    def session_closed(self, event_data: dict) -> None:
-        """Handle play_closed event"""
-        session_id = event_data["id"]
-
-        with self._lock:
-            session = self._sessions.pop(session_id, None)
-
-            if session:
-                # Calculate watch time and bytes for this session
-                closed_at = event_data.get("closed_at", 0)
-                watch_time_ms = closed_at - session.opened_at if closed_at else 0
-                final_bytes = event_data.get("bytes", 0)
-                bytes_delta = final_bytes - session.bytes
-
-                # Update minute counters
-                self._minute_closed += 1
-                self._minute_bytes += bytes_delta
-                self._minute_watch_time_ms += watch_time_ms
-                self._minute_unique_users.add(session.user_id)
-
-                # Update dimension stats
-                self._get_dimension_stats(self._minute_by_server, session.server).add_closed(session.user_id, bytes_delta, watch_time_ms)
-                self._get_dimension_stats(self._minute_by_channel, session.media).add_closed(session.user_id, bytes_delta, watch_time_ms)
-                self._get_dimension_stats(self._minute_by_country, session.country).add_closed(session.user_id, bytes_delta, watch_time_ms)
-                self._get_dimension_stats(self._minute_by_protocol, session.proto).add_closed(session.user_id, bytes_delta, watch_time_ms)
-                self._get_dimension_stats(self._minute_by_user_agent, session.user_agent_class).add_closed(session.user_id, bytes_delta, watch_time_ms)
-            else:
-                # Session not found - still count the close event
-                user_agent_class = classify_user_agent_cached(event_data.get("user_agent", ""))
-                user_id = event_data.get("user_id") or event_data["id"]
-                country = event_data.get("country") or "XX"
-                proto = event_data.get("proto") or "unknown"
-
-                self._minute_closed += 1
-                self._minute_bytes += event_data.get("bytes", 0)
-                self._minute_unique_users.add(user_id)
-
-                # Update dimension stats
-                self._get_dimension_stats(self._minute_by_server, event_data["server"]).add_closed(user_id, event_data.get("bytes", 0), 0)
-                self._get_dimension_stats(self._minute_by_channel, event_data["media"]).add_closed(user_id, event_data.get("bytes", 0), 0)
-                self._get_dimension_stats(self._minute_by_country, country).add_closed(user_id, event_data.get("bytes", 0), 0)
-                self._get_dimension_stats(self._minute_by_protocol, proto).add_closed(user_id, event_data.get("bytes", 0), 0)
-                self._get_dimension_stats(self._minute_by_user_agent, user_agent_class).add_closed(user_id, event_data.get("bytes", 0), 0)
+            minute.by_server[event.server].add_closed(user_id, final_bytes, 0)
+            minute.by_channel[event.media].add_closed(user_id, final_bytes, 0)
+            minute.by_country[country].add_closed(user_id, final_bytes, 0)
+            minute.by_protocol[proto].add_closed(user_id, final_bytes, 0)
+            minute.by_user_agent[user_agent_class].add_closed(user_id, final_bytes, 0)
 
     def get_and_reset_minute_stats(self) -> dict:
         """
         Get all stats for the current minute and reset counters.
         Called by aggregator every minute.
         """
-        with self._lock:
-            # Snapshot current concurrent counts by dimension
-            concurrent_by_server: Dict[str, int] = {}
-            concurrent_by_channel: Dict[str, int] = {}
-            concurrent_by_country: Dict[str, int] = {}
-            concurrent_by_protocol: Dict[str, int] = {}
-            concurrent_by_user_agent: Dict[str, int] = {}
-
-            for session in self._sessions.values():
-                concurrent_by_server[session.server] = concurrent_by_server.get(session.server, 0) + 1
-                concurrent_by_channel[session.media] = concurrent_by_channel.get(session.media, 0) + 1
-                concurrent_by_country[session.country] = concurrent_by_country.get(session.country, 0) + 1
-                concurrent_by_protocol[session.proto] = concurrent_by_protocol.get(session.proto, 0) + 1
-                concurrent_by_user_agent[session.user_agent_class] = concurrent_by_user_agent.get(session.user_agent_class, 0) + 1
+        sessions = self.get_all_sessions()
+
+        # Swap in a fresh minute - webhooks are only held off for the swap itself
+        fresh = self._spare_minute
+        assert fresh is not self._minute, "spare minute is still the live minute"
+        fresh.reset(peak_concurrent=len(sessions))  # Start with current
+        with self._counters_lock:
+            minute, self._minute = self._minute, fresh
+
+        try:
+            # The finished minute is no longer shared - summarize it unlocked
+            # Current concurrent counts by dimension - Counter does the tallying in C
+            concurrent_by_server = minute.by_server.fold(Counter(map(attrgetter("server"), sessions)))
+            concurrent_by_channel = minute.by_channel.fold(Counter(map(attrgetter("media"), sessions)))
+            concurrent_by_country = Counter(map(attrgetter("country"), sessions))
+            concurrent_by_protocol = Counter(map(attrgetter("proto"), sessions))
+            concurrent_by_user_agent = Counter(map(attrgetter("user_agent_class"), sessions))
 
             stats = {
                 "global": {
-                    "sessions_started": self._minute_started,
-                    "sessions_closed": self._minute_closed,
-                    "total_bytes": self._minute_bytes,
-                    "watch_time_seconds": self._minute_watch_time_ms // 1000,
-                    "unique_users": len(self._minute_unique_users),
-                    "peak_concurrent": self._minute_peak_concurrent,
-                    "current_concurrent": len(self._sessions),
+                    "sessions_started": minute.started,
+                    "sessions_closed": minute.closed,
+                    "total_bytes": minute.bytes,
+                    "watch_time_seconds": minute.watch_time_ms // 1000,
+                    "unique_users": round(minute.unique_users.get_estimate()),
+                    "peak_concurrent": minute.peak_concurrent,
+                    "current_concurrent": len(sessions),
                 },
-                "by_server": self._finalize_dimension_stats(self._minute_by_server, concurrent_by_server),
-                "by_channel": self._finalize_dimension_stats(self._minute_by_channel, concurrent_by_channel),
-                "by_country": self._finalize_dimension_stats(self._minute_by_country, concurrent_by_country),
-                "by_protocol": self._finalize_dimension_stats(self._minute_by_protocol, concurrent_by_protocol),
-                "by_user_agent": self._finalize_dimension_stats(self._minute_by_user_agent, concurrent_by_user_agent),
+                "by_server": self._finalize_dimension_stats(minute.by_server, concurrent_by_server),
+                "by_channel": self._finalize_dimension_stats(minute.by_channel, concurrent_by_channel),
+                "by_country": self._finalize_dimension_stats(minute.by_country, concurrent_by_country),
+                "by_protocol": self._finalize_dimension_stats(minute.by_protocol, concurrent_by_protocol),
+                "by_user_agent": self._finalize_dimension_stats(minute.by_user_agent, concurrent_by_user_agent),
             }
-
-            # Reset minute counters
-            self._minute_started = 0
-            self._minute_closed = 0
-            self._minute_bytes = 0
-            self._minute_watch_time_ms = 0
-            self._minute_unique_users.clear()
-            self._minute_peak_concurrent = len(self._sessions)  # Start with current
-            self._minute_by_server.clear()
-            self._minute_by_channel.clear()
-            self._minute_by_country.clear()
-            self._minute_by_protocol.clear()
-            self._minute_by_user_agent.clear()
-
             return stats
+        finally:
+            # Hand the finished minute back as the spare even if summarizing
+            # failed, so the next cycle never resets the live minute
+            self._spare_minute = minute
 
     def get_all_sessions(self) -> list[Session]:
-        """Get all active sessions for DB persistence"""
-        with self._lock:
-            return list(self._sessions.values())
+        """Get all active sessions for DB persistence (lock-free snapshot)"""
+        while True:
+            try:
+                return list(self._sessions.values())
+            except RuntimeError:
+                # Dict resized by another thread mid-copy - take the snapshot again
+                continue
+
+    def active_summary(self) -> dict:
+        """Active session counts for /stats/active, counted straight off the dict (no list copy)"""
+        while True:
+            try:
+                sessions = self._sessions.values()
+                return {
+                    "active_sessions": len(self._sessions),
+                    "by_server": dict(Counter(map(attrgetter("server"), sessions))),
+                    "by_channel": dict(Counter(map(attrgetter("media"), sessions))),
+                }
+            except RuntimeError:
+                # Dict resized by another thread mid-count - count again
+                continue
 
     def restore_sessions(self, sessions: list[Session]) -> None:
         """Restore sessions from DB on startup"""
-        with self._lock:
-            for session in sessions:
-                self._sessions[session.id] = session
-            self._minute_peak_concurrent = len(self._sessions)
-
-    def _get_dimension_stats(self, dimension_dict: dict, key: str) -> "DimensionStats":
-        if key not in dimension_dict:
-            dimension_dict[key] = DimensionStats()
-        return dimension_dict[key]
+        self._sessions.update((session.id, session) for session in sessions)
+        with self._counters_lock:
+            self._minute.peak_concurrent = len(self._sessions)
 
     def _finalize_dimension_stats(self, dimension_dict: Dict[str, "DimensionStats"], concurrent: Dict[str, int]) -> dict:
         result = {}
-        all_keys = set(dimension_dict.keys()) | set(concurrent.keys())
-        for key in all_keys:
-            stats = dimension_dict.get(key, DimensionStats())
+        empty = DimensionStats()  # Shared stand-in for keys with only concurrent sessions
+        for key in dimension_dict.keys() | concurrent.keys():
+            stats = dimension_dict.get(key, empty)
+            peak_concurrent = max(stats.peak_concurrent, concurrent.get(key, 0))
+            if not (stats.started or stats.closed or peak_concurrent):
+                continue  # Entry kept from an earlier minute, no activity this one
             result[key] = {
                 "sessions_started": stats.started,
                 "sessions_closed": stats.closed,
                 "total_bytes": stats.bytes,
                 "watch_time_seconds": stats.watch_time_ms // 1000,
-                "unique_users": len(stats.unique_users),
-                "peak_concurrent": max(stats.peak_concurrent, concurrent.get(key, 0)),
+                "unique_users": round(stats.unique_users.get_estimate()),
+                "peak_concurrent": peak_concurrent,
             }
         return result
 
@@ -214,23 +312,79 @@ class ActiveSessionsManager:
 class DimensionStats:
     """Stats accumulator for a single dimension value"""
 
-    def __init__(self):
+    __slots__ = ("started", "closed", "bytes", "watch_time_ms", "unique_users", "peak_concurrent")
+
+    def __init__(self) -> None:
         self.started: int = 0
         self.closed: int = 0
         self.bytes: int = 0
         self.watch_time_ms: int = 0
-        self.unique_users: Set[str] = set()
+        self.unique_users: hll_sketch = _new_unique_users()
         self.peak_concurrent: int = 0
 
+    def reset(self) -> None:
+        self.started = 0
+        self.closed = 0
+        self.bytes = 0
+        self.watch_time_ms = 0
+        self.unique_users.reset()
+        self.peak_concurrent = 0
+
     def add_started(self, user_id: str) -> None:
         self.started += 1
-        self.unique_users.add(user_id)
+        self.unique_users.update(user_id)
 
     def add_closed(self, user_id: str, bytes_delta: int, watch_time_ms: int) -> None:
         self.closed += 1
         self.bytes += bytes_delta
         self.watch_time_ms += watch_time_ms
-        self.unique_users.add(user_id)
+        self.unique_users.update(user_id)
+
+
+# Stands in for every value of a dimension beyond its per-minute limit
+OTHER_DIMENSION_VALUE = "__other__"
+
+
+class BoundedDimensionMap(dict):
+    """
+    DimensionStats by dimension value, holding at most max_values values.
+    Once full, newly seen values all share a single "__other__" entry.
+    """
+
+    __slots__ = ("max_values",)
+
+    def __init__(self, max_values: int):
+        super().__init__()
+        self.max_values = max_values
+
+    def __missing__(self, key: str) -> DimensionStats:
+        if len(self) >= self.max_values:
+            key = OTHER_DIMENSION_VALUE
+            if key in self:
+                return self[key]
+        stats = self[key] = DimensionStats()
+        return stats
+
+    def fold(self, concurrent: Counter[str]) -> Counter[str]:
+        """
+        Apply the same limit to a concurrent-count snapshot: values already in
+        the map keep their counts, the largest of the rest fill any remaining
+        room, and the remainder is summed into "__other__".
+        """
+        if len(concurrent) + len(self) <= self.max_values:
+            return concurrent
+
+        room = self.max_values - len(self)
+        folded: Counter[str] = Counter()
+        for key, count in concurrent.most_common():
+            if key in self:
+                folded[key] = count
+            elif room > 0:
+                folded[key] = count
+                room -= 1
+            else:
+                folded[OTHER_DIMENSION_VALUE] += count
+        return folded
 
 
 # Global singleton
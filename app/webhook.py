@@ -1,7 +1,11 @@
 # app/webhook.py
 
-from fastapi import APIRouter, Request
-from typing import List, Union
+import asyncio
+import msgspec
+from datetime import date, datetime
+from fastapi import APIRouter, Request, Response
+from app.classifier import classify_user_agent_cached
+from app.config import settings
 from app.schemas import StreamEvent, WebhookResponse
 from app.sessions import sessions_manager
 import logging
@@ -10,43 +14,80 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Decoders are built once and reused for every request
+_batch_decoder = msgspec.json.Decoder(list[msgspec.Raw])
+_raw_decoder = msgspec.json.Decoder(msgspec.Raw)
+# Lax mode - like the Pydantic model this replaced, numeric strings, epoch
+# times and whole floats are coerced instead of rejected
+_event_decoder = msgspec.json.Decoder(StreamEvent, strict=False)
+_dict_decoder = msgspec.json.Decoder(dict)
+
+# Validated event batches waiting for ingest_worker (bounded - when full,
+# requests wait for room)
+ingest_queue: asyncio.Queue = asyncio.Queue(maxsize=settings.webhook_queue_size)
+
+
+def _decode_event(raw_event: msgspec.Raw) -> StreamEvent:
+    """
+    Decode one raw event into a StreamEvent.
+    A date-only time ("2025-11-24") is read as midnight, as the Pydantic model
+    did - msgspec only parses full datetimes, so those events take a slow path.
+    """
+    try:
+        return _event_decoder.decode(raw_event)
+    except msgspec.ValidationError as e:
+        if not str(e).endswith("`$.time`"):
+            raise
+        event = _dict_decoder.decode(raw_event)
+        try:
+            day = date.fromisoformat(event["time"])
+        except (TypeError, ValueError):
+            raise e from None
+        event["time"] = datetime(day.year, day.month, day.day)
+        return msgspec.convert(event, StreamEvent, strict=False)
+
 
 @router.post("/api/webhook", response_model=WebhookResponse)
-async def receive_webhook(request: Request) -> WebhookResponse:
+async def receive_webhook(request: Request, response: Response) -> WebhookResponse:
     """
     Receive streaming events from servers.
     Accepts single event or array of events.
+    Valid events are queued for ingest_worker and answered with 202.
     """
-    body = await request.json()
-
-    # Normalize to list
-    if isinstance(body, dict):
-        events = [body]
-    elif isinstance(body, list):
-        events = body
-    else:
+    body = await request.body()
+
+    # Split into raw per-event JSON first - each event is then decoded straight
+    # into a StreamEvent, so one bad event doesn't reject the whole batch
+    try:
+        start = body.lstrip()[:1]
+        if start == b"[":
+            events = _batch_decoder.decode(body)
+        elif start == b"{":
+            events = [_raw_decoder.decode(body)]  # Still checks the JSON is well-formed
+        else:
+            return WebhookResponse(status="error", processed=0, errors=1)
+    except msgspec.DecodeError:
         return WebhookResponse(status="error", processed=0, errors=1)
 
-    processed = 0
+    valid_events = []
     errors = 0
 
-    for event_data in events:
+    for raw_event in events:
         try:
-            # Validate event
-            event = StreamEvent(**event_data)
-
-            # Route to appropriate handler
-            if event.event == "play_started":
-                sessions_manager.session_started(event_data)
-            elif event.event == "play_closed":
-                sessions_manager.session_closed(event_data)
-
-            processed += 1
+            # Decode and validate event - the typed struct is what gets ingested
+            valid_events.append(_decode_event(raw_event))
 
         except Exception as e:
             errors += 1
             logger.warning(f"Failed to process event: {e}")
 
+    if valid_events:
+        # Only waits if the worker is a full queue behind - batches must stay
+        # in order, so a start is never overtaken by its own close
+        await ingest_queue.put(valid_events)
+        response.status_code = 202
+    processed = len(valid_events)
+
     return WebhookResponse(
         status="ok" if errors == 0 else "partial",
         processed=processed,
@@ -54,6 +95,28 @@ async def receive_webhook(request: Request) -> WebhookResponse:
     )
 
 
+async def ingest_worker() -> None:
+    """
+    Apply queued webhook batches to the sessions manager.
+    Everything queued since the last pass is ingested as one batch.
+    Runs until cancelled - await ingest_queue.join() first to drain it.
+    """
+    while True:
+        events = await ingest_queue.get()
+        batches = 1
+        while not ingest_queue.empty():
+            events.extend(ingest_queue.get_nowait())
+            batches += 1
+
+        try:
+            sessions_manager.ingest_batch(events)
+        except Exception as e:
+            logger.error(f"Failed to ingest {len(events)} events: {e}")
+        finally:
+            for _ in range(batches):
+                ingest_queue.task_done()
+
+
 @router.get("/health")
 async def health_check():
     """Simple health check endpoint"""
@@ -63,18 +126,11 @@ async def health_check():
 @router.get("/stats/active")
 async def active_sessions_count():
     """Quick endpoint to check current active sessions"""
-    sessions = sessions_manager.get_all_sessions()
-    return {
-        "active_sessions": len(sessions),
-        "by_server": count_by_attribute(sessions, "server"),
-        "by_channel": count_by_attribute(sessions, "media"),
-    }
-
-
-def count_by_attribute(sessions: list, attr: str) -> dict:
-    """Helper to count sessions by attribute"""
-    counts = {}
-    for session in sessions:
-        key = getattr(session, attr)
-        counts[key] = counts.get(key, 0) + 1
-    return counts
\ No newline at end of file
+    return sessions_manager.active_summary()
+
+
+@router.get("/stats/ua-cache")
+async def user_agent_cache_stats():
+    """Hit/miss counters of the user agent classification cache"""
+    return classify_user_agent_cached.cache_info()._asdict()
+
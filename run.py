@@ -10,4 +10,6 @@ if __name__ == "__main__":
         port=5000,
         reload=False,
         workers=1,  # Single worker - required for in-memory sessions
+        loop="uvloop",
+        http="httptools",
     )
\ No newline at end of file